@@ -16,32 +16,120 @@
 import weechat
 
 import os
-import subprocess
+import time
+from collections import OrderedDict
 
-weechat.register('irssinotifier_ng', 'Benjamin Richter <br@waldteufel.eu>', '0.1', 'GPL3', 'forward notifications via irssinotifier', '', '')
+SETTINGS = {
+    'coalesce_delay': ('5', 'seconds to collect messages of a channel into a single push'),
+    'rate_limit': ('10', 'minimum seconds between two pushes'),
+    'timeout': ('30', 'seconds after which a push worker is killed'),
+}
+
+weechat.register('irssinotifier_ng', 'Benjamin Richter <br@waldteufel.eu>', '0.2', 'GPL3', 'forward notifications via irssinotifier', '', '')
 weechat.hook_print('', 'irc_privmsg', '', 1, 'mobile_notify_hook', '')
+weechat.hook_signal('relay_client_*', 'relay_changed_hook', '')
 
-def mobile_notify_hook(udata, buf, date, tags, displayed, highlight, prefix, message):
-    if os.getenv('TMUX'):
-        tmux_path = os.getenv('TMUX').split(',')[0]
-        if os.access(tmux_path, os.X_OK):
-            return weechat.WEECHAT_RC_OK
+for option, (default, description) in SETTINGS.items():
+    if not weechat.config_is_set_plugin(option):
+        weechat.config_set_plugin(option, default)
+    weechat.config_set_desc_plugin(option, '{} (default: {})'.format(description, default))
+
+class Batch(object):
+    def __init__(self):
+        self.count = 0
+        self.prefixes = OrderedDict()
+        self.last = None
+
+pending = OrderedDict()
+flush_timer = None
+last_push = 0
+relay_connected = False
+
+def config_seconds(option):
+    try:
+        return max(0, float(weechat.config_get_plugin(option)))
+    except ValueError:
+        return float(SETTINGS[option][0])
 
+def update_relay_connected():
+    global relay_connected
+    relay_connected = False
     relays = weechat.infolist_get('relay', '', '')
     if relays:
         while weechat.infolist_next(relays):
-            status = weechat.infolist_string(relays, 'status_string')
-            if status == 'connected':
-                weechat.infolist_free(relays)
-                return weechat.WEECHAT_RC_OK
+            if weechat.infolist_string(relays, 'status_string') == 'connected':
+                relay_connected = True
+                break
         weechat.infolist_free(relays)
 
-    if displayed and (highlight or 'notify_private' in tags.split(',')):
-        if weechat.buffer_get_string(buf, 'localvar_type') == 'private':
-            channel = '!PRIVATE'
-        else:
-            channel = weechat.buffer_get_string(buf, 'localvar_name')
+def is_attached():
+    if os.getenv('TMUX'):
+        tmux_path = os.getenv('TMUX').split(',')[0]
+        return os.access(tmux_path, os.X_OK)
+    return False
+
+def relay_changed_hook(udata, signal, data):
+    update_relay_connected()
+    return weechat.WEECHAT_RC_OK
+
+def schedule_flush(delay):
+    global flush_timer
+    if flush_timer is None:
+        flush_timer = weechat.hook_timer(max(1, int(delay * 1000)), 0, 1, 'flush_hook', '')
+
+def flush_hook(udata, remaining_calls):
+    global flush_timer, last_push
+    flush_timer = None
+    if not pending:
+        return weechat.WEECHAT_RC_OK
 
-        subprocess.check_call(['irssinotifier_ng', message, channel, prefix])
+    if relay_connected or is_attached():
+        pending.clear()
+        return weechat.WEECHAT_RC_OK
 
+    wait = last_push + config_seconds('rate_limit') - time.time()
+    if wait > 0:
+        schedule_flush(wait)
+        return weechat.WEECHAT_RC_OK
+
+    channel, batch = pending.popitem(last=False)
+    if batch.count == 1:
+        prefix, message = batch.last
+    else:
+        prefix = batch.last[0]
+        message = '{} new messages from {}'.format(batch.count, ', '.join(batch.prefixes))
+
+    weechat.hook_process_hashtable('irssinotifier_ng', {'arg1': message, 'arg2': channel, 'arg3': prefix},
+                                   int(config_seconds('timeout') * 1000), 'push_done_hook', '')
+    last_push = time.time()
+
+    if pending:
+        schedule_flush(config_seconds('rate_limit'))
     return weechat.WEECHAT_RC_OK
+
+def push_done_hook(udata, command, return_code, out, err):
+    if return_code > 0 or return_code == weechat.WEECHAT_HOOK_PROCESS_ERROR:
+        weechat.prnt('', '{}irssinotifier_ng: push failed: {}'.format(weechat.prefix('error'), err.strip()))
+    return weechat.WEECHAT_RC_OK
+
+def mobile_notify_hook(udata, buf, date, tags, displayed, highlight, prefix, message):
+    if not (displayed and (highlight or 'notify_private' in tags.split(','))):
+        return weechat.WEECHAT_RC_OK
+
+    if relay_connected or is_attached():
+        return weechat.WEECHAT_RC_OK
+
+    if weechat.buffer_get_string(buf, 'localvar_type') == 'private':
+        channel = '!PRIVATE'
+    else:
+        channel = weechat.buffer_get_string(buf, 'localvar_name')
+
+    batch = pending.setdefault(channel, Batch())
+    batch.count += 1
+    batch.prefixes[prefix] = None
+    batch.last = (prefix, message)
+    schedule_flush(config_seconds('coalesce_delay'))
+
+    return weechat.WEECHAT_RC_OK
+
+update_relay_connected()
@@ -21,11 +21,44 @@ import weechat
 import os
 import stat
 import time
+import errno
+import struct
+import ctypes
+import ctypes.util
 
-weechat.register('tmux11_away', 'Benjamin Richter <br@waldteufel.eu>', '0.1', 'GPL3', 'tmux11away mechanism', '', '')
-weechat.hook_timer(2000, 0, 0, 'check_away', '')
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+weechat.register('tmux11_away', 'Benjamin Richter <br@waldteufel.eu>', '0.2', 'GPL3', 'tmux11away mechanism', 'shutdown_hook', '')
 
 last_reason = None
+deadline_timer = None
+inotify_fd = None
+
+tmux_path = os.getenv('TMUX').split(',')[0]
+runtime_dir = os.getenv('XDG_RUNTIME_DIR')
+activity_path = os.path.join(runtime_dir, 'activity')
+
+def inotify_init():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+
+    def add_watch(path, mask):
+        return libc.inotify_add_watch(fd, path.encode(), mask) >= 0
+
+    if not add_watch(tmux_path, IN_ATTRIB) or not add_watch(runtime_dir, IN_CREATE | IN_MOVED_TO):
+        os.close(fd)
+        return None
+    return fd, add_watch
 
 def set_away(reason):
     global last_reason
@@ -33,23 +66,91 @@ def set_away(reason):
     weechat.command('', '/away -all ' + reason)
     last_reason = reason
 
-def check_away(data, remaining_calls):
-    time_now = time.time()
+def update_away(time_now):
+    tmux_stat = os.stat(tmux_path)
+    deadlines = []
 
-    tmux_stat = os.stat(os.getenv('TMUX').split(',')[0])
-    if (tmux_stat.st_mode & stat.S_IXUSR) == 0 and tmux_stat.st_ctime <= time_now - TIMEOUT_DETACHED:
-        set_away('detached')
-        return weechat.WEECHAT_RC_OK
+    if (tmux_stat.st_mode & stat.S_IXUSR) == 0:
+        detached_deadline = tmux_stat.st_ctime + TIMEOUT_DETACHED
+        if detached_deadline <= time_now:
+            set_away('detached')
+            return None
+        deadlines.append(detached_deadline)
 
-    activity_path = os.path.join(os.getenv('XDG_RUNTIME_DIR'), 'activity')
     if os.path.exists(activity_path):
         last_activity = max(tmux_stat.st_ctime, os.stat(activity_path).st_ctime)
     else:
         last_activity = tmux_stat.st_ctime
 
-    if last_activity <= time_now - TIMEOUT_IDLE:
+    idle_deadline = last_activity + TIMEOUT_IDLE
+    if idle_deadline <= time_now:
         set_away('idle')
     else:
         set_away('')
+        deadlines.append(idle_deadline)
+
+    return min(deadlines) if deadlines else None
 
+def check_away(data, remaining_calls):
+    update_away(time.time())
     return weechat.WEECHAT_RC_OK
+
+def arm_deadline():
+    global deadline_timer
+    if deadline_timer is not None:
+        weechat.unhook(deadline_timer)
+        deadline_timer = None
+
+    time_now = time.time()
+    deadline = update_away(time_now)
+    if deadline is not None:
+        delay = max(1, int((deadline - time_now) * 1000) + 1)
+        deadline_timer = weechat.hook_timer(delay, 0, 1, 'deadline_hook', '')
+
+def deadline_hook(data, remaining_calls):
+    global deadline_timer
+    deadline_timer = None
+    arm_deadline()
+    return weechat.WEECHAT_RC_OK
+
+def inotify_events():
+    while True:
+        try:
+            buf = os.read(inotify_fd, 4096)
+        except OSError as e:
+            if e.errno == errno.EAGAIN: return
+            raise
+        if not buf: return
+
+        offset = 0
+        while offset < len(buf):
+            wd, mask, cookie, length = struct.unpack_from('iIII', buf, offset)
+            offset += struct.calcsize('iIII')
+            yield buf[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+def inotify_hook(data, fd):
+    # only the runtime directory watch reports names, the others report b''
+    if not any(name in (b'', b'activity') for name in list(inotify_events())):
+        return weechat.WEECHAT_RC_OK
+
+    if os.path.exists(activity_path):
+        inotify_add_watch(activity_path, IN_ATTRIB | IN_MODIFY)
+
+    arm_deadline()
+    return weechat.WEECHAT_RC_OK
+
+def shutdown_hook():
+    if inotify_fd is not None:
+        os.close(inotify_fd)
+    return weechat.WEECHAT_RC_OK
+
+inotify = inotify_init()
+if inotify is None:
+    weechat.hook_timer(2000, 0, 0, 'check_away', '')
+else:
+    inotify_fd, inotify_add_watch = inotify
+    if os.path.exists(activity_path):
+        inotify_add_watch(activity_path, IN_ATTRIB | IN_MODIFY)
+    weechat.hook_fd(inotify_fd, 1, 0, 0, 'inotify_hook', '')
+    arm_deadline()